@@ -1,9 +1,16 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
 import boto3
 import pymysql
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import os
+from cur_ingest import ingest_cur, is_under
+from inventory_sync import has_changes, sync_inventory
+from schema import init_schema, compact_table, maintain_partitions
+from sync_pipeline import Stage, run_pipeline
+from pricing import billing_window, hours_in_window, ec2_price, rds_price
+from s3_storage import fetch_storage_metrics
+from response_cache import cached_response, invalidate, invalidates_cache
 
 app = Flask(__name__)
 
@@ -15,6 +22,7 @@ DB_NAME = os.getenv('DB_NAME')
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION = os.getenv('AWS_REGION')
+CUR_PATH = os.getenv('CUR_PATH')  # Local directory or s3://bucket/prefix holding Cost and Usage Report files
 
 # AWS Cost Explorer Client
 client = boto3.client('ce', region_name='us-east-1')
@@ -43,27 +51,40 @@ def get_db_connection():
     )
 
 
-def fetch_cost_data():
-    try:
-        today = datetime.today()
-        start_date = (today - timedelta(days=30)).strftime('%Y-%m-%d')  # Last 30 days
-        end_date = today.strftime('%Y-%m-%d')
+def iter_cost_data():
+    """Yield the ResultsByTime of each Cost Explorer page for the last 30 days."""
+    today = datetime.today()
+    start_date = (today - timedelta(days=30)).strftime('%Y-%m-%d')  # Last 30 days
+    end_date = today.strftime('%Y-%m-%d')
 
-        response = client.get_cost_and_usage(
-            TimePeriod={
-                'Start': start_date,
-                'End': end_date
-            },
-            Granularity='DAILY',
-            Metrics=['UnblendedCost', 'UsageQuantity'],
-            GroupBy=[
-                {'Type': 'DIMENSION', 'Key': 'SERVICE'},
-                {'Type': 'DIMENSION', 'Key': 'REGION'}
-            ]
-        )
-        
+    request_args = {
+        'TimePeriod': {
+            'Start': start_date,
+            'End': end_date
+        },
+        'Granularity': 'DAILY',
+        'Metrics': ['UnblendedCost', 'UsageQuantity'],
+        'GroupBy': [
+            {'Type': 'DIMENSION', 'Key': 'SERVICE'},
+            {'Type': 'DIMENSION', 'Key': 'REGION'}
+        ]
+    }
+    while True:
+        response = client.get_cost_and_usage(**request_args)
         print("AWS Response:", response)  # Add this line to print the response
-        return response.get('ResultsByTime', [])
+        yield response.get('ResultsByTime', [])
+
+        if not response.get('NextPageToken'):
+            break
+        request_args['NextPageToken'] = response['NextPageToken']
+
+
+def fetch_cost_data():
+    try:
+        cost_data = []
+        for page in iter_cost_data():
+            cost_data.extend(page)
+        return cost_data
     except Exception as e:
         print(f"Error fetching data from AWS: {e}")
         raise
@@ -107,6 +128,7 @@ def insert_cost_data(cost_data):
 
 
 @app.route('/fetch-and-insert-cost-data', methods=['GET'])
+@invalidates_cache
 def fetch_and_insert_cost_data():
     try:
         print("Fetching AWS cost data...")
@@ -122,41 +144,108 @@ def fetch_and_insert_cost_data():
         return jsonify({"error": str(e)}), 500
 
 
+# Flask route to ingest detailed line items from Cost and Usage Report files
+@app.route('/ingest-cur-data', methods=['GET'])
+@invalidates_cache
+def ingest_cur_data():
+    try:
+        if not CUR_PATH:
+            return jsonify({"error": "CUR_PATH is not set."}), 400
+        # ?path= may only narrow the ingest to a sub-directory or sub-prefix of CUR_PATH
+        cur_path = request.args.get('path', CUR_PATH)
+        if not is_under(cur_path, CUR_PATH):
+            return jsonify({"error": "path must be CUR_PATH or a location under it."}), 400
+        print(f"Ingesting CUR files from {cur_path}...")
+        summary = ingest_cur(cur_path, get_db_connection)
+        return jsonify({"message": "CUR data successfully inserted into the database.", "summary": summary}), 200
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+# Flask route to create the tables, or migrate hand-made ones to the managed schema
+@app.route('/init-schema', methods=['GET'])
+@invalidates_cache
+def init_schema_route():
+    db = get_db_connection()
+    try:
+        init_schema(db)
+        return jsonify({"message": "Database schema is up to date."}), 200
+    except Exception as e:
+        print(f"Error migrating the database schema: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.close()
+
+
+# Flask route to roll old daily cost/usage rows up into monthly rows
+@app.route('/compact-cost-data', methods=['GET'])
+@invalidates_cache
+def compact_cost_data():
+    db = get_db_connection()
+    try:
+        # Add next months' partitions first, so rows that reached pmax are moved into their month
+        added = maintain_partitions(db)
+        compacted = {name: compact_table(db, name) for name in ('cost', 'usage')}
+        return jsonify({"message": "Old cost data compacted.", "partitions": compacted,
+                        "partitions_added": added}), 200
+    except Exception as e:
+        print(f"Error compacting cost data: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.close()
+
+
 # Flask route to check server status
 @app.route('/status', methods=['GET'])
 def status():
     return jsonify({"message": "Server is running."}), 200
 
-def fetch_ec2_data():
+def ec2_record(instance, window_start, window_end):
+    """One ec2_instances row for a describe_instances entry; every EC2 writer uses this shape."""
+    per_unit_cost = ec2_price(instance)
+    hours_used = hours_in_window(instance['LaunchTime'], window_start, window_end) \
+        if instance['State']['Name'] == 'running' else 0.0
+    return {
+        'instance_id': instance['InstanceId'],
+        'instance_type': instance['InstanceType'],
+        'state': instance['State']['Name'],
+        'private_ip': instance.get('PrivateIpAddress'),
+        'public_ip': instance.get('PublicIpAddress'),
+        'launch_time': instance['LaunchTime'],
+        'total_cost': round(hours_used * per_unit_cost, 6),
+        'start_date': window_start.strftime('%Y-%m-%d'),
+        'end_date': window_end.strftime('%Y-%m-%d'),
+        'hours_used': hours_used,
+        'per_unit_cost_usd': per_unit_cost,
+        'cpu_utilization': 0.0,  # Placeholder for CPU utilization
+        'memory_utilization_mb': 0.0,  # Placeholder for memory utilization
+        'cpu_max': 0.0,  # Placeholder for max CPU usage
+        'max_memory_util': 0.0  # Placeholder for max memory usage
+    }
+
+
+def describe_all_reservations(ec2_client):
+    """Every reservation across all describe_instances pages."""
+    paginator = ec2_client.get_paginator('describe_instances')
+    return [reservation for page in paginator.paginate() for reservation in page['Reservations']]
+
+
+def fetch_ec2_instances():
     try:
-        # Describe EC2 instances
-        instances = ec2_client.describe_instances()
+        # Describe every EC2 instance; instances missing from the listing are recorded as terminated
+        reservations = describe_all_reservations(ec2_client)
         
         # Print the raw response to check if EC2 instances are returned
-        print(instances)  # Add this line to print the response
+        print(reservations)  # Add this line to print the response
         
         ec2_data = []  # List to store EC2 instance data
-        
+        window_start, window_end = billing_window()  # Month to date, priced from the local pricing index
+
         # Loop through the instances and extract relevant details
-        for reservation in instances['Reservations']:
+        for reservation in reservations:
             for instance in reservation['Instances']:
-                ec2_data.append({
-                    'instance_id': instance['InstanceId'],
-                    'instance_type': instance['InstanceType'],
-                    'state': instance['State']['Name'],
-                    'private_ip': instance.get('PrivateIpAddress'),
-                    'public_ip': instance.get('PublicIpAddress'),
-                    'launch_time': instance['LaunchTime'],
-                    'total_cost': 0.00,  # Placeholder for cost data
-                    'start_date': datetime.today().strftime('%Y-%m-%d'),
-                    'end_date': datetime.today().strftime('%Y-%m-%d'),
-                    'hours_used': 0.0,  # Placeholder for usage data
-                    'per_unit_cost_usd': 0.0,  # Placeholder for cost per unit
-                    'cpu_utilization': 0.0,  # Placeholder for CPU utilization
-                    'memory_utilization_mb': 0.0,  # Placeholder for memory utilization
-                    'cpu_max': 0.0,  # Placeholder for max CPU usage
-                    'max_memory_util': 0.0  # Placeholder for max memory usage
-                })
+                ec2_data.append(ec2_record(instance, window_start, window_end))
 
         return ec2_data  # Return the extracted EC2 data
 
@@ -165,76 +254,81 @@ def fetch_ec2_data():
         raise
 
 
-# Function to insert EC2 instance data into MySQL
+# (record key, ec2_instances column) pairs written by every EC2 writer
+EC2_COLUMNS = [
+    ('instance_id', 'instance_id'), ('instance_type', 'instance_type'), ('launch_time', 'launch_time'),
+    ('state', 'state'), ('private_ip', 'private_ip'), ('public_ip', 'public_ip'),
+    ('total_cost', 'total_cost'), ('start_date', 'start_date'), ('end_date', 'end_date'),
+    ('hours_used', 'hours_used'), ('per_unit_cost_usd', 'per_unit_cost_usd'),
+    ('cpu_utilization', 'cpu_utilization'), ('memory_utilization_mb', 'memory_utilization_mb'),
+    ('cpu_max', 'cpu_max'), ('max_memory_util', 'max_memory_util')
+]
+
+# Function to write EC2 instance changes into MySQL
 def insert_ec2_data(ec2_data):
-    cursor = db.cursor()
+    db = get_db_connection()
     try:
-        for data in ec2_data:
-            # SQL Insert Command
-            sql = """
-                INSERT INTO ec2_instances 
-                (instance_id, instance_type, launch_time, state, private_ip, public_ip, 
-                total_cost, Start_Date, End_Date, Hours_Used, Per_Unit_Cost_USD, 
-                CPU_Utilization, Memory_Utilization_MB, cpu_max, MAX_MEMORY_UTIL)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            
-            # Execute SQL Command
-            cursor.execute(sql, (
-                data['instance_id'], data['instance_type'], data['launch_time'], data['state'], 
-                data['private_ip'], data['public_ip'], data['total_cost'], data['start_date'], 
-                data['end_date'], data['hours_used'], data['per_unit_cost_usd'], 
-                data['cpu_utilization'], data['memory_utilization_mb'], data['cpu_max'], data['max_memory_util']
-            ))
+        # Only new, changed and terminated instances are written
+        changes = sync_inventory(db, 'ec2', 'ec2_instances', 'instance_id', ec2_data, EC2_COLUMNS)
 
         # Commit changes to the database
         db.commit()
-        print("EC2 data committed to the database.")
+        print(f"EC2 data committed to the database: {changes}")
+        return changes
     except Exception as e:
         print(f"Error inserting EC2 data into the database: {e}")
         db.rollback()
         raise
     finally:
-        cursor.close()
+        db.close()
 
 # Flask route to fetch and insert EC2 data
 @app.route('/fetch-and-insert-ec2-data', methods=['GET'])
+@invalidates_cache
 def fetch_and_insert_ec2_data():
     try:
-        ec2_data = fetch_ec2_data()
+        ec2_data = fetch_ec2_instances()
         if not ec2_data:
             return jsonify({"message": "No EC2 data available."}), 200
         else:
-            insert_ec2_data(ec2_data)
-            return jsonify({"message": "EC2 data successfully inserted into the database."}), 200
+            changes = insert_ec2_data(ec2_data)
+            return jsonify({"message": "EC2 data successfully inserted into the database.", "changes": changes}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+def s3_record(bucket, storage):
+    """One s3_buckets row for a list_buckets entry and its storage analytics; every S3 writer uses this shape."""
+    return {
+        'bucket_name': bucket['Name'],
+        'creation_date': bucket['CreationDate'],
+        'region': storage['region'],
+        'total_usage': storage['total_usage'],  # GB stored
+        'total_cost': storage['total_cost'],  # USD per month at current size
+        'instance_type': 'N/A',  # Placeholder for instance type
+        'start_date': datetime.today().strftime('%Y-%m-%d'),
+        'end_date': datetime.today().strftime('%Y-%m-%d'),
+        'hours_used': 0.0,  # Placeholder for hours used
+        'per_unit_cost_usd': round(storage['total_cost'] / storage['total_usage'], 6) if storage['total_usage'] else 0.0,
+        'cpu_utilization': 0.0,  # Placeholder for CPU utilization
+        'memory_utilization_mb': 0.0,  # Placeholder for memory utilization
+        'cpu_max': 0.0,  # Placeholder for max CPU usage
+        'max_memory_util': 0.0  # Placeholder for max memory usage
+    }
+
+
 def fetch_s3_data():
     try:
         # List all S3 buckets
         response = s3_client.list_buckets()
-        
+
+        # Size per storage class from CloudWatch daily storage metrics, priced per GB-month
+        analytics = fetch_storage_metrics(s3_client, [bucket['Name'] for bucket in response['Buckets']])
+
         s3_data = []
         
         # Extract relevant S3 bucket data
         for bucket in response['Buckets']:
-            s3_data.append({
-                'bucket_name': bucket['Name'],
-                'creation_date': bucket['CreationDate'],
-                'region': 'us-east-1',  # Assuming all buckets are in 'us-east-1', you can fetch it dynamically if needed
-                'total_usage': 0.0,  # Placeholder for total usage
-                'total_cost': 0.0,  # Placeholder for cost data
-                'instance_type': 'N/A',  # Placeholder for instance type
-                'start_date': datetime.today().strftime('%Y-%m-%d'),
-                'end_date': datetime.today().strftime('%Y-%m-%d'),
-                'hours_used': 0.0,  # Placeholder for hours used
-                'per_unit_cost_usd': 0.0,  # Placeholder for cost per unit
-                'cpu_utilization': 0.0,  # Placeholder for CPU utilization
-                'memory_utilization_mb': 0.0,  # Placeholder for memory utilization
-                'cpu_max': 0.0,  # Placeholder for max CPU usage
-                'max_memory_util': 0.0  # Placeholder for max memory usage
-            })
+            s3_data.append(s3_record(bucket, analytics[bucket['Name']]))
 
         return s3_data
     except Exception as e:
@@ -242,33 +336,27 @@ def fetch_s3_data():
         raise
 
 
-# Function to insert S3 bucket data into MySQL
+# (record key, s3_buckets column) pairs written by every S3 writer
+S3_COLUMNS = [
+    ('bucket_name', 'bucket_name'), ('creation_date', 'creation_date'), ('region', 'region'),
+    ('total_usage', 'total_usage'), ('total_cost', 'total_cost'), ('instance_type', 'instance_type'),
+    ('start_date', 'start_date'), ('end_date', 'end_date'), ('hours_used', 'hours_used'),
+    ('per_unit_cost_usd', 'per_unit_cost_usd'), ('cpu_utilization', 'cpu_utilization'),
+    ('memory_utilization_mb', 'memory_utilization_mb'), ('cpu_max', 'cpu_max'),
+    ('max_memory_util', 'max_memory_util')
+]
+
+# Function to write S3 bucket changes into MySQL
 def insert_s3_data(s3_data):
     db = get_db_connection()
     try:
-        cursor = db.cursor()
-        
-        for data in s3_data:
-            # SQL Insert Command
-            sql = """
-                INSERT INTO s3_buckets 
-                (bucket_name, creation_date, region, total_usage, total_cost, instance_type, 
-                start_date, end_date, hours_used, per_unit_cost_usd, cpu_utilization, 
-                memory_utilization_mb, cpu_max, max_memory_util)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            
-            # Execute SQL Command
-            cursor.execute(sql, (
-                data['bucket_name'], data['creation_date'], data['region'], data['total_usage'], 
-                data['total_cost'], data['instance_type'], data['start_date'], data['end_date'], 
-                data['hours_used'], data['per_unit_cost_usd'], data['cpu_utilization'], 
-                data['memory_utilization_mb'], data['cpu_max'], data['max_memory_util']
-            ))
+        # Only new, changed and deleted buckets are written
+        changes = sync_inventory(db, 's3', 's3_buckets', 'bucket_name', s3_data, S3_COLUMNS)
 
         # Commit changes to the database
         db.commit()
-        print("S3 bucket data committed to the database.")
+        print(f"S3 bucket data committed to the database: {changes}")
+        return changes
     except Exception as e:
         print(f"Error inserting S3 data into the database: {e}")
         db.rollback()
@@ -278,14 +366,15 @@ def insert_s3_data(s3_data):
 
 
 @app.route('/fetch-and-insert-s3-data', methods=['GET'])
+@invalidates_cache
 def fetch_and_insert_s3_data():
     try:
         s3_data = fetch_s3_data()
         if not s3_data:
             return jsonify({"message": "No S3 bucket data available."}), 200
         else:
-            insert_s3_data(s3_data)
-            return jsonify({"message": "S3 bucket data successfully inserted into the database."}), 200
+            changes = insert_s3_data(s3_data)
+            return jsonify({"message": "S3 bucket data successfully inserted into the database.", "changes": changes}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -343,9 +432,9 @@ def insert_rds_data(rds_data):
                 (db_instance_id, db_instance_class, db_engine, db_status, master_username, 
                 endpoint_address, endpoint_port, vpc_id, availability_zone, multi_az, 
                 backup_retention_period, tags, storage_encrypted, instance_create_time, 
-                license_model, cost, usage_quantity, total_cost, Instance_Type, Start_Date, 
-                End_Date, Hours_Used, Per_Unit_Cost_USD, CPU_Utilization, 
-                Memory_Utilization_MB, cpu_max, MAX_MEMORY_UTIL)
+                license_model, cost, usage_quantity, total_cost, instance_type, start_date, 
+                end_date, hours_used, per_unit_cost_usd, cpu_utilization, 
+                memory_utilization_mb, cpu_max, max_memory_util)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """
             cursor.execute(sql, (
@@ -371,6 +460,7 @@ def insert_rds_data(rds_data):
         db.close()
         
 @app.route('/fetch-and-insert-rds-data', methods=['GET'])
+@invalidates_cache
 def fetch_and_insert_rds_data():
     try:
         rds_data = fetch_rds_data()
@@ -386,16 +476,20 @@ def fetch_rds_data():
     try:
         response = rds_client.describe_db_instances()
         rds_data = []
+        window_start, window_end = billing_window()  # Month to date, priced from the local pricing index
 
         for db_instance in response['DBInstances']:
+            per_unit_cost = rds_price(db_instance)
+            hours_used = hours_in_window(db_instance.get('InstanceCreateTime'), window_start, window_end) \
+                if db_instance.get('DBInstanceStatus') == 'available' else 0.0
             rds_data.append({
                 'instance_type': db_instance.get('DBInstanceClass'),
-                'start_date': datetime.today().strftime('%Y-%m-%d'),
-                'end_date': datetime.today().strftime('%Y-%m-%d'),
+                'start_date': window_start.strftime('%Y-%m-%d'),
+                'end_date': window_end.strftime('%Y-%m-%d'),
                 'region': db_instance.get('AvailabilityZone', 'unknown-region'),
-                'hours_used': 0.0,  # Placeholder for hours used
-                'per_unit_cost_usd': 0.0,  # Placeholder for cost per unit
-                'total_cost_usd': 0.0,  # Placeholder for total cost
+                'hours_used': hours_used,
+                'per_unit_cost_usd': per_unit_cost,
+                'total_cost_usd': round(hours_used * per_unit_cost, 6),
                 'cpu_utilization_percent': 0.0,  # Placeholder for CPU utilization
                 'memory_utilization_mb': 0.0,  # Placeholder for memory utilization
                 'cpu_max': 0.0,  # Placeholder for max CPU usage
@@ -437,6 +531,7 @@ def insert_rds_data(rds_data):
         db.close()
         
 @app.route('/fetch-and-insert-instance-usage', methods=['GET'])
+@invalidates_cache
 def fetch_and_insert_instance_usage():
     try:
         rds_data = fetch_rds_data()
@@ -463,18 +558,14 @@ def test_api():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
-if __name__ == '__main__':
-    app.run(debug=True, use_reloader=True)
-
 # Import necessary libraries at the top
 import boto3
 from botocore.exceptions import ClientError
-from flask import Flask, jsonify
+from flask import jsonify
 import mysql.connector
 import json
 
-# Initialize Flask app
-app = Flask(__name__)
+# The routes below register on the same app as the ones above, so `python aws.py` serves all of them
 
 # MySQL Connection configuration
 db_config = {
@@ -494,6 +585,7 @@ def create_aws_clients():
 
 # Get EC2, RDS, and S3 resources
 @app.route('/get-resources', methods=['GET'])
+@cached_response()
 def get_resources():
     try:
         ec2_client, rds_client, s3_client, ce_client = create_aws_clients()
@@ -546,6 +638,7 @@ def get_resources():
 
 @app.route('/get-cost-usage', methods=['GET'])
 def get_cost_usage():
+    inserted = 0
     try:
         _, _, _, ce_client = create_aws_clients()
 
@@ -578,12 +671,19 @@ def get_cost_usage():
                 region = group.get('Region', None)  
 
                 try:
+                    # Skip groups already stored by an earlier poll, so repeated calls write nothing
                     cursor.execute('''
                     INSERT INTO cost 
                     (cost_amount, currency, billing_period, service_type, resource_id, cost_date, usage_type, region, total_cost)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ''', (unblended_cost, 'USD', period['TimePeriod']['Start'], usage_type, resource_id, period['TimePeriod']['Start'], usage_type, region, unblended_cost))
+                    SELECT %s, %s, %s, %s, %s, %s, %s, %s, %s FROM DUAL
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM cost
+                        WHERE resource_id = %s AND cost_date = %s AND usage_type = %s AND data_source = 'ce'
+                    )
+                    ''', (unblended_cost, 'USD', period['TimePeriod']['Start'], usage_type, resource_id, period['TimePeriod']['Start'], usage_type, region, unblended_cost,
+                          resource_id, period['TimePeriod']['Start'], usage_type))
                     conn.commit()
+                    inserted += cursor.rowcount
                 except Exception as e:
                     print("Error inserting data:", e)
 
@@ -596,53 +696,47 @@ def get_cost_usage():
         return jsonify({'error': str(e)}), 400
     except mysql.connector.Error as err:
         return jsonify({'error': str(err)}), 500
+    finally:
+        # Dashboards poll this route; only clear cached responses when rows were committed
+        if inserted:
+            invalidate()
 
 # Get S3 resource details
 @app.route('/get-s3-resources', methods=['GET'])
 def get_s3_resources():
     try:
-        _, _, s3_client, ce_client = create_aws_clients()
+        _, _, s3_client, _ = create_aws_clients()
 
         conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor()
 
         s3_response = s3_client.list_buckets()
+        analytics = fetch_storage_metrics(s3_client, [bucket['Name'] for bucket in s3_response['Buckets']])
         s3_buckets = []
+        s3_data = []
 
         for bucket in s3_response['Buckets']:
             bucket_name = bucket['Name']
-            creation_date = bucket['CreationDate'].strftime('%Y-%m-%d %H:%M:%S')
-
-            region = s3_client.get_bucket_location(Bucket=bucket_name)['LocationConstraint']
-
-            usage_response = ce_client.get_cost_and_usage(
-                TimePeriod={'Start': '2024-10-01', 'End': '2024-10-21'},
-                Granularity='DAILY',
-                Metrics=['UsageQuantity', 'UnblendedCost'],
-                Filter={'Dimensions': {'Key': 'SERVICE', 'Values': ['Amazon Simple Storage Service']}}
-            )
-
-            total_usage, total_cost = 0, 0.0
-            for period in usage_response['ResultsByTime']:
-                for group in period['Groups']:
-                    total_usage += float(group['Metrics']['UsageQuantity']['Amount'])
-                    total_cost += float(group['Metrics']['UnblendedCost']['Amount'])
+            storage = analytics[bucket_name]
 
+            s3_data.append(s3_record(bucket, storage))
             s3_buckets.append({
                 'bucket_name': bucket_name,
-                'creation_date': creation_date,
-                'region': region,
-                'total_usage': total_usage,
-                'total_cost': total_cost
+                'creation_date': bucket['CreationDate'].strftime('%Y-%m-%d %H:%M:%S'),
+                'region': storage['region'],
+                'total_usage': storage['total_usage'],
+                'total_cost': storage['total_cost'],
+                'objects': storage['objects'],
+                'storage': storage['storage']
             })
 
-            cursor.execute('''INSERT INTO s3_buckets (bucket_name, creation_date, region, total_usage, total_cost)
-                            VALUES (%s, %s, %s, %s, %s)''',
-                        (bucket_name, creation_date, region, total_usage, total_cost))
+        # Only new, changed and deleted buckets are written
+        changes = sync_inventory(conn, 's3', 's3_buckets', 'bucket_name', s3_data, S3_COLUMNS)
 
         conn.commit()
-        cursor.close()
         conn.close()
+        # Dashboards poll this route; only clear cached responses when the inventory changed
+        if has_changes(changes):
+            invalidate()
 
         return jsonify(s3_buckets)
 
@@ -654,36 +748,28 @@ def get_s3_resources():
 
 # Fetch EC2 data and insert into MySQL
 @app.route('/fetch-ec2-data', methods=['GET'])
+@invalidates_cache
 def fetch_ec2_data():
     ec2_client, _, _, _ = create_aws_clients()
     connection = None
     cursor = None
 
     try:
-        response = ec2_client.describe_instances()
-        instances = response['Reservations']
+        instances = describe_all_reservations(ec2_client)
 
         connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
 
+        ec2_instances = []
+        window_start, window_end = billing_window()
         for reservation in instances:
             for instance in reservation['Instances']:
-                instance_info = {
-                    'instance_id': instance['InstanceId'],
-                    'instance_type': instance['InstanceType'],
-                    'launch_time': instance['LaunchTime'].strftime('%Y-%m-%d %H:%M:%S'),
-                    'state': instance['State']['Name'],
-                    'private_ip': instance.get('PrivateIpAddress', 'N/A'),
-                    'public_ip': instance.get('PublicIpAddress', 'N/A'),
-                }
-
-                cursor.execute('''INSERT INTO ec2_instances (instance_id, instance_type, launch_time, state, private_ip, public_ip)
-                                VALUES (%s, %s, %s, %s, %s, %s)''',
-                                (instance_info['instance_id'], instance_info['instance_type'], instance_info['launch_time'],
-                                instance_info['state'], instance_info['private_ip'], instance_info['public_ip']))
+                ec2_instances.append(ec2_record(instance, window_start, window_end))
+
+        # Only new, changed and terminated instances are written
+        changes = sync_inventory(connection, 'ec2', 'ec2_instances', 'instance_id', ec2_instances, EC2_COLUMNS)
 
         connection.commit()
-        return jsonify({'message': 'EC2 data fetched and stored successfully.'})
+        return jsonify({'message': 'EC2 data fetched and stored successfully.', 'changes': changes})
 
     except ClientError as e:
         return jsonify({'error': str(e)}), 400
@@ -722,85 +808,131 @@ def get_rds_cost(instance_id, start_date, end_date):
 
     return total_cost
 
+# (record key, rds_instances column) pairs written for each DB instance
+RDS_COLUMNS = [(key, key) for key in (
+    'db_instance_id', 'db_instance_class', 'db_engine', 'db_status', 'db_instance_status',
+    'master_username', 'endpoint_address', 'endpoint_port', 'vpc_id', 'availability_zone',
+    'multi_az', 'backup_retention_period', 'tags', 'storage_encrypted', 'instance_create_time',
+    'license_model', 'cost', 'usage_quantity', 'total_cost', 'start_date', 'end_date', 'hours_used',
+    'per_unit_cost_usd'
+)]
+
+def collect_rds_instances(rds_client):
+    # Fetch every RDS instance; a single call returns at most 100, and missing ones are recorded as terminated
+    paginator = rds_client.get_paginator('describe_db_instances')
+    db_instances = [instance for page in paginator.paginate() for instance in page['DBInstances']]
+
+    rds_data = []
+    window_start, window_end = billing_window()  # Month to date, priced from the local pricing index
+    for instance in db_instances:
+        per_unit_cost = rds_price(instance)
+        hours_used = hours_in_window(instance.get('InstanceCreateTime'), window_start, window_end) \
+            if instance.get('DBInstanceStatus') == 'available' else 0.0
+        rds_data.append({
+            'db_instance_id': instance['DBInstanceIdentifier'],
+            'db_instance_class': instance.get('DBInstanceClass'),
+            'db_engine': instance.get('Engine'),
+            'db_status': instance.get('DBInstanceStatus'),
+            'db_instance_status': instance.get('DBInstanceStatus'),
+            'master_username': instance.get('MasterUsername'),
+            'endpoint_address': instance['Endpoint']['Address'] if 'Endpoint' in instance else None,
+            'endpoint_port': instance['Endpoint']['Port'] if 'Endpoint' in instance else None,
+            'vpc_id': instance.get('DBSubnetGroup', {}).get('VpcId'),
+            'availability_zone': instance.get('AvailabilityZone'),
+            'multi_az': instance.get('MultiAZ'),
+            'backup_retention_period': instance.get('BackupRetentionPeriod'),
+            'tags': json.dumps(instance.get('TagList', [])),  # Convert tags to JSON string
+            'storage_encrypted': instance.get('StorageEncrypted'),
+            'instance_create_time': instance.get('InstanceCreateTime'),
+            'license_model': instance.get('LicenseModel'),
+            'cost': None,  # To be populated if needed
+            'usage_quantity': None,  # To be populated if needed
+            'total_cost': round(hours_used * per_unit_cost, 6),
+            'start_date': window_start.strftime('%Y-%m-%d'),
+            'end_date': window_end.strftime('%Y-%m-%d'),
+            'hours_used': hours_used,
+            'per_unit_cost_usd': per_unit_cost
+        })
+    return rds_data
+
 # API to get RDS instance data
 @app.route('/get-rds-data', methods=['GET'])
 def get_rds_data():
-    rds_client = None
     connection = None
-    cursor = None
 
     try:
         _, rds_client, _, _ = create_aws_clients()
-
-        # Fetch RDS instances
-        response = rds_client.describe_db_instances()
-        rds_instances = response['DBInstances']
+        rds_data_to_insert = collect_rds_instances(rds_client)
 
         # Connect to MySQL
         connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-
-        # Prepare list to store RDS data
-        rds_data_to_insert = []
-
-        for instance in rds_instances:
-            rds_data = {
-                'db_instance_id': instance['DBInstanceIdentifier'],
-                'db_instance_class': instance.get('DBInstanceClass'),
-                'db_engine': instance.get('Engine'),
-                'db_status': instance.get('DBInstanceStatus'),
-                'db_instance_status': instance.get('DBInstanceStatus'),
-                'master_username': instance.get('MasterUsername'),
-                'endpoint_address': instance['Endpoint']['Address'] if 'Endpoint' in instance else None,
-                'endpoint_port': instance['Endpoint']['Port'] if 'Endpoint' in instance else None,
-                'vpc_id': instance.get('DBSubnetGroup', {}).get('VpcId'),
-                'availability_zone': instance.get('AvailabilityZone'),
-                'multi_az': instance.get('MultiAZ'),
-                'backup_retention_period': instance.get('BackupRetentionPeriod'),
-                'tags': json.dumps(instance.get('TagList', [])),  # Convert tags to JSON string
-                'storage_encrypted': instance.get('StorageEncrypted'),
-                'instance_create_time': instance.get('InstanceCreateTime'),
-                'license_model': instance.get('LicenseModel'),
-                'cost': None,  # To be populated if needed
-                'usage_quantity': None  # To be populated if needed
-            }
 
-            rds_data_to_insert.append(rds_data)
-
-            # Insert into MySQL
-            cursor.execute('''
-            INSERT INTO rds_instances (
-                db_instance_id, db_instance_class, db_engine, 
-                db_status, db_instance_status, master_username, 
-                endpoint_address, endpoint_port, vpc_id, 
-                availability_zone, multi_az, backup_retention_period, 
-                tags, storage_encrypted, instance_create_time, 
-                license_model, cost, usage_quantity
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', (
-            rds_data['db_instance_id'], rds_data['db_instance_class'], 
-            rds_data['db_engine'], rds_data['db_status'], 
-            rds_data['db_instance_status'], rds_data['master_username'], 
-            rds_data['endpoint_address'], rds_data['endpoint_port'], 
-            rds_data['vpc_id'], rds_data['availability_zone'], 
-            rds_data['multi_az'], rds_data['backup_retention_period'], 
-            rds_data['tags'], rds_data['storage_encrypted'], 
-            rds_data['instance_create_time'], rds_data['license_model'], 
-            rds_data['cost'], rds_data['usage_quantity']
-        ))
+        # Only new, changed and deleted DB instances are written
+        changes = sync_inventory(connection, 'rds', 'rds_instances', 'db_instance_id', rds_data_to_insert, RDS_COLUMNS)
 
         connection.commit()
-        return jsonify({'message': 'RDS data fetched and stored successfully.', 'data': rds_data_to_insert})
+        # Dashboards poll this route; only clear cached responses when the inventory changed
+        if has_changes(changes):
+            invalidate()
+        return jsonify({'message': 'RDS data fetched and stored successfully.', 'changes': changes, 'data': rds_data_to_insert})
 
     except ClientError as e:
         return jsonify({'error': str(e)}), 400
     except mysql.connector.Error as err:
         return jsonify({'error': str(err)}), 500
     finally:
-        if cursor:
-            cursor.close()
         if connection:
             connection.close()
 
+
+def write_rds_instances(rds_data):
+    db = get_db_connection()
+    try:
+        changes = sync_inventory(db, 'rds', 'rds_instances', 'db_instance_id', rds_data, RDS_COLUMNS)
+        db.commit()
+        return changes
+    except Exception as e:
+        print(f"Error inserting RDS data into the database: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def sync_stages():
+    """The collectors and writers run by /sync-all, one stage per table group."""
+    _, rds_client, _, _ = create_aws_clients()
+    return [
+        # Cost Explorer pages are written while the next page is being fetched
+        Stage('cost', iter_cost_data, insert_cost_data),
+        # Inventory is diffed against the last snapshot, so each one is written as a single batch
+        Stage('ec2', lambda: [fetch_ec2_instances()], insert_ec2_data),
+        Stage('s3', lambda: [fetch_s3_data()], insert_s3_data),
+        Stage('rds', lambda: [collect_rds_instances(rds_client)], write_rds_instances),
+        # fetch_rds_data / insert_rds_data here are the instance_usage versions defined last above
+        Stage('instance_usage', lambda: [fetch_rds_data()], insert_rds_data),
+    ]
+
+
+# Run every collector concurrently, writing as data arrives
+@app.route('/sync-all', methods=['GET'])
+@invalidates_cache
+def sync_all():
+    try:
+        # Keep monthly partitions ahead of the cost and usage rows this sync writes
+        db = get_db_connection()
+        try:
+            maintain_partitions(db)
+        finally:
+            db.close()
+
+        summary = run_pipeline(sync_stages())
+        status_code = 200 if summary['succeeded'] else 500
+        return jsonify({'message': 'Sync finished.' if summary['succeeded'] else 'Sync finished with errors.',
+                        'summary': summary}), status_code
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(debug=True)
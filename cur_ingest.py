@@ -0,0 +1,307 @@
+import json
+import os
+import re
+from datetime import datetime
+from itertools import repeat
+
+import boto3
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Rows read from a CUR file per chunk. Memory use is bounded by this and by the
+# number of distinct (day, resource, usage type) keys, never by the file size.
+CHUNK_ROWS = 500000
+
+# Rows sent to MySQL per executemany() batch
+INSERT_BATCH_ROWS = 5000
+
+# CUR column names we need, mapped to our own names. CSV reports use the
+# "lineItem/UsageStartDate" style, Parquet reports the "line_item_usage_start_date" style.
+CUR_COLUMNS = {
+    'lineItem/UsageStartDate': 'usage_start',
+    'lineItem/ResourceId': 'resource_id',
+    'lineItem/UsageType': 'usage_type',
+    'lineItem/ProductCode': 'service_type',
+    'product/region': 'region',
+    'lineItem/CurrencyCode': 'currency',
+    'lineItem/UsageAmount': 'usage_amount',
+    'lineItem/UnblendedCost': 'unblended_cost',
+}
+CUR_PARQUET_COLUMNS = {
+    'line_item_usage_start_date': 'usage_start',
+    'line_item_resource_id': 'resource_id',
+    'line_item_usage_type': 'usage_type',
+    'line_item_product_code': 'service_type',
+    'product_region': 'region',
+    'line_item_currency_code': 'currency',
+    'line_item_usage_amount': 'usage_amount',
+    'line_item_unblended_cost': 'unblended_cost',
+}
+
+# Directory names CUR uses for a billing period, e.g. 20241001-20241101
+PERIOD_DIR = re.compile(r'^\d{8}-\d{8}$')
+
+# Marks the cost/usage rows written by this module, so re-ingesting a period replaces only them
+DATA_SOURCE = 'cur'
+
+GROUP_KEYS = ['cost_date', 'resource_id', 'usage_type', 'service_type', 'region', 'currency']
+
+s3_client = boto3.client('s3', region_name='us-east-1')
+
+
+def is_under(path, root):
+    """True if path is root itself or a location inside it (local directory or s3:// prefix)."""
+    if root.startswith('s3://'):
+        if not path.startswith('s3://'):
+            return False
+        path, root = path.rstrip('/'), root.rstrip('/')
+        return path == root or path.startswith(root + '/')
+    if path.startswith('s3://'):
+        return False
+    path, root = os.path.realpath(path), os.path.realpath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+def _list_files(path, suffixes):
+    """Return every file under a local directory or an s3://bucket/prefix ending in one of suffixes."""
+    if path.startswith('s3://'):
+        bucket, _, prefix = path[len('s3://'):].partition('/')
+        files = []
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith(suffixes):
+                    files.append(f"s3://{bucket}/{obj['Key']}")
+        return sorted(files)
+
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.endswith(suffixes):
+                files.append(os.path.join(root, name))
+    return sorted(files)
+
+
+def _read_manifest(path):
+    stream = _open_cur_file(path)
+    try:
+        return json.loads(stream.read())
+    finally:
+        stream.close()
+
+
+def _parent_dir(path):
+    return os.path.basename(os.path.dirname(path.rstrip('/')))
+
+
+def _manifest_report(manifest_path):
+    """Resolve a billing-period manifest to (period start, period end, report files)."""
+    manifest = _read_manifest(manifest_path)
+    period = manifest['billingPeriod']
+    start = datetime.strptime(period['start'][:8], '%Y%m%d').date()
+    end = datetime.strptime(period['end'][:8], '%Y%m%d').date()
+
+    if manifest_path.startswith('s3://'):
+        bucket = manifest.get('bucket') or manifest_path[len('s3://'):].partition('/')[0]
+        files = [f"s3://{bucket}/{key}" for key in manifest['reportKeys']]
+    else:
+        # A local copy keeps the <period>/<assemblyId>/ layout under the manifest's directory
+        period_dir = os.path.dirname(manifest_path)
+        files = []
+        for key in manifest['reportKeys']:
+            name = os.path.basename(key)
+            candidates = [os.path.join(period_dir, manifest.get('assemblyId', ''), name),
+                          os.path.join(period_dir, name)]
+            files.append(next((c for c in candidates if os.path.exists(c)), candidates[0]))
+    return start, end, files
+
+
+def list_cur_reports(path):
+    """Return the current version of every CUR billing period under path.
+
+    Each entry is (period start, period end, files); start and end are None when
+    the period is taken from the dates in the files. AWS rewrites a month's report
+    several times, each version in its own <assemblyId>/ folder, and the
+    billing-period manifest next to those folders names the current one. Only
+    that version is read. Files without a period manifest, such as the Parquet
+    year=/month= layout or a plain folder of exports, are grouped by directory.
+    """
+    manifests = [m for m in _list_files(path, ('-Manifest.json',)) if PERIOD_DIR.match(_parent_dir(m))]
+    reports = [_manifest_report(manifest) for manifest in manifests]
+
+    covered = {os.path.dirname(manifest) for manifest in manifests}
+    by_directory = {}
+    for cur_file in _list_files(path, ('.csv', '.csv.gz', '.parquet')):
+        directory = os.path.dirname(cur_file)
+        if directory in covered or os.path.dirname(directory) in covered:
+            continue
+        by_directory.setdefault(directory, []).append(cur_file)
+    reports += [(None, None, files) for _, files in sorted(by_directory.items())]
+    return reports
+
+
+def _open_cur_file(path):
+    """Open a CUR file as a binary stream without reading it into memory."""
+    if path.startswith('s3://'):
+        bucket, _, key = path[len('s3://'):].partition('/')
+        return s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    return open(path, 'rb')
+
+
+def iter_cur_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Yield column-projected DataFrames of at most chunk_rows line items from one CUR file."""
+    if path.endswith('.parquet'):
+        if path.startswith('s3://'):
+            # Parquet needs random access to its footer, so S3 objects go through pyarrow's filesystem
+            from pyarrow import fs
+            filesystem, key = fs.FileSystem.from_uri(path)
+            parquet_file = pq.ParquetFile(filesystem.open_input_file(key))
+        else:
+            parquet_file = pq.ParquetFile(path)
+        available = set(parquet_file.schema_arrow.names)
+        columns = [c for c in CUR_PARQUET_COLUMNS if c in available]
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas().rename(columns=CUR_PARQUET_COLUMNS)
+        return
+
+    stream = _open_cur_file(path)
+    try:
+        # pandas decompresses on the fly and leaves closing the underlying stream to us
+        with pd.read_csv(
+            stream,
+            compression='gzip' if path.endswith('.gz') else None,
+            usecols=lambda c: c in CUR_COLUMNS,
+            dtype={'lineItem/ResourceId': 'string', 'lineItem/UsageType': 'string'},
+            chunksize=chunk_rows,
+        ) as reader:
+            for chunk in reader:
+                yield chunk.rename(columns=CUR_COLUMNS)
+    finally:
+        stream.close()
+
+
+def aggregate_chunk(chunk):
+    """Reduce a chunk of line items to daily x resource x usage type totals."""
+    for column in ('resource_id', 'usage_type', 'service_type', 'region', 'currency'):
+        if column not in chunk:
+            chunk[column] = ''
+    chunk['cost_date'] = pd.to_datetime(chunk['usage_start'], utc=True).dt.strftime('%Y-%m-%d')
+    chunk['usage_amount'] = pd.to_numeric(chunk['usage_amount'], errors='coerce').fillna(0.0)
+    chunk['unblended_cost'] = pd.to_numeric(chunk['unblended_cost'], errors='coerce').fillna(0.0)
+    chunk[GROUP_KEYS] = chunk[GROUP_KEYS].fillna('')
+    return chunk.groupby(GROUP_KEYS, sort=False, as_index=False)[['usage_amount', 'unblended_cost']].sum()
+
+
+def _merge_totals(totals, partial):
+    if totals is None:
+        return partial
+    merged = pd.concat([totals, partial], ignore_index=True)
+    return merged.groupby(GROUP_KEYS, sort=False, as_index=False)[['usage_amount', 'unblended_cost']].sum()
+
+
+def aggregate_cur_files(paths, chunk_rows=CHUNK_ROWS):
+    """Stream CUR files and return their combined aggregated totals and the number of line items read."""
+    totals = None
+    line_items = 0
+    for path in paths:
+        print(f"Reading CUR file {path}...")
+        for chunk in iter_cur_chunks(path, chunk_rows):
+            line_items += len(chunk)
+            totals = _merge_totals(totals, aggregate_chunk(chunk))
+    return totals, line_items
+
+
+def _batches(rows, size=INSERT_BATCH_ROWS):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def delete_cur_period(db, start, end):
+    """Remove previously ingested CUR rows dated in [start, end). The caller commits."""
+    cursor = db.cursor()
+    try:
+        cursor.execute(
+            "DELETE FROM cost WHERE data_source = %s AND cost_date >= %s AND cost_date < %s",
+            (DATA_SOURCE, start, end)
+        )
+        cursor.execute(
+            "DELETE FROM `usage` WHERE data_source = %s AND start_date >= %s AND start_date < %s",
+            (DATA_SOURCE, start, end)
+        )
+    finally:
+        cursor.close()
+
+
+def insert_cur_totals(db, totals):
+    """Bulk-load aggregated CUR totals into the cost and usage tables. The caller commits."""
+    cursor = db.cursor()
+    try:
+        cost_rows = list(zip(
+            totals['cost_date'], totals['service_type'], totals['region'], totals['unblended_cost'],
+            totals['usage_type'], totals['unblended_cost'], totals['resource_id'], totals['currency'],
+            repeat(DATA_SOURCE),
+        ))
+        usage_rows = list(zip(
+            totals['resource_id'], totals['cost_date'], totals['cost_date'], totals['unblended_cost'],
+            totals['currency'], totals['usage_amount'], totals['service_type'], totals['region'],
+            totals['usage_type'], totals['unblended_cost'], repeat(DATA_SOURCE),
+        ))
+
+        # Every value is a placeholder so executemany sends one multi-row INSERT per batch
+        cost_sql = """
+            INSERT INTO cost (
+                cost_date, service_type, region, cost_amount, usage_type, total_cost, resource_id, currency,
+                data_source
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        usage_sql = """
+            INSERT INTO `usage` (
+                resource_id, start_date, end_date, unblended_cost, currency, usage_amount,
+                service_type, region, usage_type, total_cost, data_source
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        for batch in _batches(cost_rows):
+            cursor.executemany(cost_sql, batch)
+        for batch in _batches(usage_rows):
+            cursor.executemany(usage_sql, batch)
+    finally:
+        cursor.close()
+
+
+def ingest_cur(path, get_db_connection, chunk_rows=CHUNK_ROWS):
+    """Ingest the current CUR version of every billing period under path into MySQL.
+
+    Each period is one transaction that first deletes the CUR rows already
+    stored for it, so re-running the ingest, or AWS re-issuing a month, replaces
+    the period instead of adding to it.
+    """
+    summary = {'reports': 0, 'files': 0, 'line_items': 0, 'rows_written': 0}
+
+    for start, end, files in list_cur_reports(path):
+        totals, line_items = aggregate_cur_files(files, chunk_rows)
+        summary['reports'] += 1
+        summary['files'] += len(files)
+        summary['line_items'] += line_items
+        if totals is None or totals.empty:
+            continue
+        if start is None:
+            # No manifest: replace exactly the days these files cover
+            start = min(totals['cost_date'])
+            end = (pd.Timestamp(max(totals['cost_date'])) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+
+        db = get_db_connection()
+        try:
+            delete_cur_period(db, start, end)
+            insert_cur_totals(db, totals)
+            db.commit()
+            summary['rows_written'] += len(totals)
+        except Exception as e:
+            print(f"Error inserting CUR data for {start} to {end} into the database: {e}")
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    return summary
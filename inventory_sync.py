@@ -0,0 +1,169 @@
+import hashlib
+import json
+from datetime import datetime
+
+from schema import ensure_inventory_tables
+
+# Fields that change on every collection run without the resource itself changing
+VOLATILE_FIELDS = ('start_date', 'end_date')
+
+# Cost figures derived from the billing window and price index. Running resources change them every day,
+# so they are kept out of the content hash and change history and refreshed in place instead.
+DERIVED_FIELDS = ('hours_used', 'per_unit_cost_usd', 'total_cost')
+
+
+def _hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def content_hash(record, columns):
+    """Return a stable SHA-256 of the record fields that describe the resource itself."""
+    return _hash({key: record.get(key) for key, _ in columns
+                  if key not in VOLATILE_FIELDS and key not in DERIVED_FIELDS})
+
+
+def metrics_hash(record, columns):
+    """Return a stable SHA-256 of the record's derived cost fields."""
+    return _hash({key: record.get(key) for key, _ in columns if key in DERIVED_FIELDS})
+
+
+def diff_inventory(previous, records, id_field, columns):
+    """Compare a fresh collection with the last known hashes.
+
+    previous maps resource id -> (content hash, metrics hash) for every live
+    resource. Returns (inserts, updates, refreshes, terminated_ids), where
+    inserts and updates are lists of (record, content hash, metrics hash) and
+    refreshes lists (record, metrics hash) for resources whose only change is
+    their derived cost.
+    """
+    inserts, updates, refreshes = [], [], []
+    seen = set()
+    for record in records:
+        resource_id = str(record[id_field])
+        if resource_id in seen:
+            continue
+        seen.add(resource_id)
+        digest = content_hash(record, columns)
+        metrics = metrics_hash(record, columns)
+        if resource_id not in previous:
+            inserts.append((record, digest, metrics))
+        elif previous[resource_id][0] != digest:
+            updates.append((record, digest, metrics))
+        elif previous[resource_id][1] != metrics:
+            refreshes.append((record, metrics))
+    terminated_ids = [resource_id for resource_id in previous if resource_id not in seen]
+    return inserts, updates, refreshes, terminated_ids
+
+
+def sync_inventory(db, resource_type, table, id_field, records, columns):
+    """Apply only the changes between records and the last snapshot to table.
+
+    columns is a list of (record key, table column) pairs; the pair whose key is
+    id_field identifies the resource. New resources are inserted, changed ones
+    updated in place and vanished ones deleted from table, and every change is
+    appended to inventory_changes. Resources whose only change is their derived
+    cost get just those columns rewritten, without a change record. The caller
+    commits.
+    """
+    id_column = dict(columns)[id_field]
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    cursor = db.cursor()
+    try:
+        ensure_inventory_tables(cursor)
+        cursor.execute(
+            "SELECT resource_id, content_hash, metrics_hash FROM inventory_state "
+            "WHERE resource_type = %s AND terminated_at IS NULL",
+            (resource_type,)
+        )
+        previous = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+        inserts, updates, refreshes, terminated_ids = diff_inventory(previous, records, id_field, columns)
+
+        column_names = ', '.join(column for _, column in columns)
+        placeholders = ', '.join(['%s'] * len(columns))
+        update_columns = [(key, column) for key, column in columns if key != id_field]
+        if inserts:
+            # A resource new to inventory_state can still have a row, e.g. one kept by the
+            # schema migration's dedupe; the table's unique key turns that insert into an update
+            upserts = ', '.join(f"{column} = VALUES({column})" for _, column in update_columns)
+            cursor.executemany(
+                f"INSERT INTO {table} ({column_names}) VALUES ({placeholders}) "
+                f"ON DUPLICATE KEY UPDATE {upserts}",
+                [tuple(record.get(key) for key, _ in columns) for record, _, _ in inserts]
+            )
+
+        if updates:
+            assignments = ', '.join(f"{column} = %s" for _, column in update_columns)
+            cursor.executemany(
+                f"UPDATE {table} SET {assignments} WHERE {id_column} = %s",
+                [tuple(record.get(key) for key, _ in update_columns) + (str(record[id_field]),)
+                 for record, _, _ in updates]
+            )
+
+        # The billing window dates go with the figures computed for it
+        refresh_columns = [(key, column) for key, column in columns
+                           if key in DERIVED_FIELDS or key in VOLATILE_FIELDS]
+        if refreshes and refresh_columns:
+            assignments = ', '.join(f"{column} = %s" for _, column in refresh_columns)
+            cursor.executemany(
+                f"UPDATE {table} SET {assignments} WHERE {id_column} = %s",
+                [tuple(record.get(key) for key, _ in refresh_columns) + (str(record[id_field]),)
+                 for record, _ in refreshes]
+            )
+
+        if terminated_ids:
+            cursor.executemany(
+                f"DELETE FROM {table} WHERE {id_column} = %s",
+                [(resource_id,) for resource_id in terminated_ids]
+            )
+
+        changed = inserts + updates
+        if changed:
+            cursor.executemany("""
+                INSERT INTO inventory_state
+                (resource_type, resource_id, content_hash, first_seen, last_changed, terminated_at, metrics_hash)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE content_hash = VALUES(content_hash),
+                    last_changed = VALUES(last_changed), terminated_at = NULL, metrics_hash = VALUES(metrics_hash)
+            """, [(resource_type, str(record[id_field]), digest, now, now, None, metrics)
+                  for record, digest, metrics in changed])
+        if refreshes:
+            cursor.executemany(
+                "UPDATE inventory_state SET metrics_hash = %s WHERE resource_type = %s AND resource_id = %s",
+                [(metrics, resource_type, str(record[id_field])) for record, metrics in refreshes]
+            )
+        if terminated_ids:
+            cursor.executemany(
+                "UPDATE inventory_state SET terminated_at = %s, last_changed = %s "
+                "WHERE resource_type = %s AND resource_id = %s",
+                [(now, now, resource_type, resource_id) for resource_id in terminated_ids]
+            )
+
+        history = [
+            (resource_type, str(record[id_field]), change_type, digest,
+             json.dumps({key: record.get(key) for key, _ in columns if key not in DERIVED_FIELDS}, default=str), now)
+            for change_type, batch in (('insert', inserts), ('update', updates))
+            for record, digest, _ in batch
+        ]
+        history += [(resource_type, resource_id, 'terminate', None, None, now) for resource_id in terminated_ids]
+        if history:
+            cursor.executemany("""
+                INSERT INTO inventory_changes
+                (resource_type, resource_id, change_type, content_hash, attributes, changed_at)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, history)
+
+        return {
+            'inserted': len(inserts),
+            'updated': len(updates),
+            'terminated': len(terminated_ids),
+            'cost_refreshed': len(refreshes),
+            'unchanged': len(previous) - len(updates) - len(refreshes) - len(terminated_ids),
+        }
+    finally:
+        cursor.close()
+
+
+def has_changes(changes):
+    """True if a sync_inventory result wrote anything to the inventory tables."""
+    return any(changes[key] for key in ('inserted', 'updated', 'terminated', 'cost_refreshed'))
@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+
+# Default location of the on-disk price index built by `python pricing.py <offer files>`
+PRICING_INDEX_PATH = os.getenv('PRICING_INDEX_PATH', 'pricing.idx')
+
+# Index layout: 8-byte magic, uint64 entry count, then entries sorted by key hash.
+# Each entry is a uint64 key hash followed by a float64 hourly USD price.
+_MAGIC = b'CAPRIDX1'
+_HEADER = struct.Struct('<8sQ')
+_ENTRY = struct.Struct('<Qd')
+
+# Describe-API values mapped to the names used in the offer files
+EC2_PLATFORMS = {
+    'linux/unix': 'linux',
+    'red hat enterprise linux': 'rhel',
+    'suse linux': 'suse',
+}
+EC2_TENANCIES = {'default': 'shared', 'dedicated': 'dedicated', 'host': 'host'}
+# Offer-file S3 volumeType mapped to the CloudWatch StorageType dimension
+S3_STORAGE_TYPES = {
+    'Standard': 'StandardStorage',
+    'Standard - Infrequent Access': 'StandardIAStorage',
+    'One Zone - Infrequent Access': 'OneZoneIAStorage',
+    'Reduced Redundancy': 'ReducedRedundancyStorage',
+    'Glacier Instant Retrieval': 'GlacierInstantRetrievalStorage',
+    'Amazon Glacier': 'GlacierStorage',
+    'Glacier Deep Archive': 'DeepArchiveStorage',
+    'Intelligent-Tiering Frequent Access': 'IntelligentTieringFAStorage',
+    'Intelligent-Tiering Infrequent Access': 'IntelligentTieringIAStorage',
+    'Intelligent-Tiering Archive Instant Access': 'IntelligentTieringAIAStorage',
+}
+RDS_ENGINES = {
+    'postgres': 'postgresql',
+    'aurora-mysql': 'aurora mysql',
+    'aurora-postgresql': 'aurora postgresql',
+    'oracle': 'oracle',
+    'sqlserver': 'sql server',
+}
+# Engine suffixes (oracle-ee, sqlserver-web, ...) mapped to the offer-file databaseEdition
+RDS_EDITIONS = {
+    'ee': 'enterprise',
+    'se': 'standard',
+    'se1': 'standard one',
+    'se2': 'standard two',
+    'ex': 'express',
+    'web': 'web',
+}
+
+
+def price_key(service, region, instance_class, platform, tenancy):
+    """Normalised lookup key: (service, region, instance/db class, OS/engine, tenancy/deployment)."""
+    return '|'.join(str(part or '').strip().lower() for part in (service, region, instance_class, platform, tenancy))
+
+
+def rds_engine_key(engine, edition=None):
+    """Engine part of an RDS price key; editions are kept apart because they are priced differently."""
+    engine = (engine or '').strip().lower()
+    return f"{engine}/{edition.strip().lower()}" if edition else engine
+
+
+def _key_hash(key):
+    return struct.unpack('<Q', hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest())[0]
+
+
+def _product_key(service, attributes):
+    """Return the price key for an offer-file product, or None if it is not an on-demand instance we track."""
+    region = attributes.get('regionCode')
+    instance_class = attributes.get('instanceType')
+    if not region or (service != 's3' and not instance_class):
+        return None
+    if attributes.get('licenseModel') == 'Bring your own license':
+        return None
+
+    if service == 's3':
+        storage_type = S3_STORAGE_TYPES.get(attributes.get('volumeType'))
+        return price_key('s3', region, storage_type, '', '') if storage_type else None
+    if service == 'ec2':
+        if attributes.get('capacitystatus', 'Used') != 'Used' or attributes.get('preInstalledSw', 'NA') != 'NA':
+            return None
+        return price_key('ec2', region, instance_class, attributes.get('operatingSystem'), attributes.get('tenancy'))
+    engine = rds_engine_key(attributes.get('databaseEngine'), attributes.get('databaseEdition'))
+    return price_key('rds', region, instance_class, engine, attributes.get('deploymentOption'))
+
+
+def _unit_price(term_offers, units):
+    """Pick the first-tier USD rate in one of units out of one SKU's OnDemand terms."""
+    for term in term_offers.values():
+        for dimension in term.get('priceDimensions', {}).values():
+            if dimension.get('unit') in units and str(dimension.get('beginRange', '0')) == '0':
+                return float(dimension['pricePerUnit'].get('USD', 0))
+    return None
+
+
+def read_offer_file(path):
+    """Stream one AWS offer file (AmazonEC2, AmazonRDS or AmazonS3 index.json) and return {key hash: price}.
+
+    EC2 and RDS prices are per hour, S3 storage prices per GB-month.
+
+    Two passes over the file keep only one product or term in memory at a time;
+    the multi-hundred-MB document itself is never loaded.
+    """
+    try:
+        import ijson
+    except ImportError:
+        raise RuntimeError("Building the price index needs the 'ijson' package (pip install ijson).")
+
+    with open(path, 'rb') as f:
+        offer_code = next(ijson.items(f, 'offerCode'), '')
+    service = {'AmazonRDS': 'rds', 'AmazonS3': 's3'}.get(offer_code, 'ec2')
+    families = {
+        'ec2': ('Compute Instance', 'Compute Instance (bare metal)'),
+        'rds': ('Database Instance',),
+        's3': ('Storage',),
+    }[service]
+    units = ('GB-Mo',) if service == 's3' else ('Hrs', 'Hours')
+
+    sku_keys = {}
+    with open(path, 'rb') as f:
+        for sku, product in ijson.kvitems(f, 'products'):
+            if product.get('productFamily') not in families:
+                continue
+            key = _product_key(service, product.get('attributes', {}))
+            if key:
+                sku_keys[sku] = _key_hash(key)
+
+    prices = {}
+    with open(path, 'rb') as f:
+        for sku, term_offers in ijson.kvitems(f, 'terms.OnDemand'):
+            key_hash = sku_keys.get(sku)
+            if key_hash is None:
+                continue
+            price = _unit_price(term_offers, units)
+            if price is None:
+                continue
+            # Engine editions have their own keys; remaining duplicates are equivalent SKUs, keep the cheapest
+            if key_hash not in prices or price < prices[key_hash]:
+                prices[key_hash] = price
+    print(f"Read {len(prices)} {service} prices from {path}")
+    return prices
+
+
+def build_index(offer_paths, index_path=PRICING_INDEX_PATH):
+    """Build the price index from one or more offer files and atomically replace index_path."""
+    prices = {}
+    for path in offer_paths:
+        prices.update(read_offer_file(path))
+
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, len(prices)))
+        for key_hash in sorted(prices):
+            f.write(_ENTRY.pack(key_hash, prices[key_hash]))
+    # Workers that already mapped the old file keep reading it until they reopen
+    os.replace(tmp_path, index_path)
+    return len(prices)
+
+
+class PriceIndex:
+    """Read-only, memory-mapped view of a price index built by build_index.
+
+    Pages are shared through the OS page cache, so every worker process can open
+    its own PriceIndex without loading the offer files. Lookups are a binary
+    search over fixed-width entries.
+    """
+
+    def __init__(self, path=PRICING_INDEX_PATH):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a pricing index")
+
+    def __len__(self):
+        return self._count
+
+    def unit_price(self, service, region, instance_class, platform, tenancy):
+        """Return the on-demand USD price, or None if the index has no such key.
+
+        The price is per hour for EC2/RDS and per GB-month for S3 storage.
+        """
+        target = _key_hash(price_key(service, region, instance_class, platform, tenancy))
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            key_hash, price = _ENTRY.unpack_from(self._map, _HEADER.size + middle * _ENTRY.size)
+            if key_hash == target:
+                return price
+            if key_hash < target:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def close(self):
+        self._map.close()
+
+
+_price_index = None
+
+
+def get_price_index():
+    """Return the process-wide PriceIndex, or None if no index has been built yet."""
+    global _price_index
+    if _price_index is None and os.path.exists(PRICING_INDEX_PATH):
+        _price_index = PriceIndex(PRICING_INDEX_PATH)
+    return _price_index
+
+
+def hours_in_window(started_at, window_start, window_end):
+    """Hours a resource started at started_at was running inside [window_start, window_end)."""
+    if started_at is None:
+        return 0.0
+    if started_at.tzinfo is None:
+        started_at = started_at.replace(tzinfo=timezone.utc)
+    start = max(started_at, window_start)
+    if start >= window_end:
+        return 0.0
+    return round((window_end - start).total_seconds() / 3600, 4)
+
+
+def billing_window(now=None):
+    """Month-to-date window ending at today's UTC midnight, so hours change once a day."""
+    now = now or datetime.now(timezone.utc)
+    window_end = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    window_start = window_end.replace(day=1)
+    if window_start == window_end:
+        # First of the month: report the whole previous month instead of an empty window
+        window_start = (window_end - timedelta(days=1)).replace(day=1)
+    return window_start, window_end
+
+
+def ec2_price(instance):
+    """Hourly on-demand price for a describe_instances entry, or 0.0 if unknown."""
+    index = get_price_index()
+    if index is None:
+        return 0.0
+    region = instance.get('Placement', {}).get('AvailabilityZone', '')[:-1]
+    platform = instance.get('PlatformDetails', 'Linux/UNIX')
+    platform = EC2_PLATFORMS.get(platform.lower(), platform)
+    tenancy = EC2_TENANCIES.get(instance.get('Placement', {}).get('Tenancy', 'default'), 'shared')
+    price = index.unit_price('ec2', region, instance.get('InstanceType'), platform, tenancy)
+    return price or 0.0
+
+
+def rds_price(db_instance):
+    """Hourly on-demand price for a describe_db_instances entry, or 0.0 if unknown."""
+    index = get_price_index()
+    if index is None:
+        return 0.0
+    region = (db_instance.get('AvailabilityZone') or '')[:-1]
+    engine = (db_instance.get('Engine') or '').lower()
+    if engine.endswith('-cdb'):
+        engine = engine[:-len('-cdb')]
+    base, _, suffix = engine.rpartition('-')
+    if base and suffix in RDS_EDITIONS:
+        engine = rds_engine_key(RDS_ENGINES.get(base, base), RDS_EDITIONS[suffix])
+    else:
+        engine = RDS_ENGINES.get(engine, engine)
+    deployment = 'multi-az' if db_instance.get('MultiAZ') else 'single-az'
+    price = index.unit_price('rds', region, db_instance.get('DBInstanceClass'), engine, deployment)
+    return price or 0.0
+
+
+def s3_storage_price(region, storage_type):
+    """USD per GB-month for a CloudWatch S3 StorageType in region, or 0.0 if unknown."""
+    index = get_price_index()
+    if index is None:
+        return 0.0
+    price = index.unit_price('s3', region, storage_type, '', '')
+    return price or 0.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the local AWS pricing index from offer files.')
+    parser.add_argument('offer_files', nargs='+', help='AmazonEC2 / AmazonRDS / AmazonS3 offer index.json files')
+    parser.add_argument('-o', '--output', default=PRICING_INDEX_PATH, help='index file to write')
+    args = parser.parse_args()
+    count = build_index(args.offer_files, args.output)
+    print(f"Wrote {count} prices to {args.output}")
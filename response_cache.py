@@ -0,0 +1,88 @@
+import hashlib
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+# Seconds a cached read response is served without re-running the view
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '30'))
+
+_lock = threading.Lock()
+_cache = {}  # (endpoint, path) -> (expires_at, data version, etag, body, mimetype)
+_data_version = 0
+
+
+def invalidate():
+    """Drop every cached response and move to a new data version, so old ETags stop matching."""
+    global _data_version
+    with _lock:
+        _data_version += 1
+        _cache.clear()
+
+
+def _cached_response(entry, ttl):
+    _, _, etag, body, mimetype = entry
+    response = current_app.response_class(body, status=200, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"private, max-age={int(ttl)}"
+    # Turns the response into a 304 with no body when If-None-Match matches
+    return response.make_conditional(request)
+
+
+def cached_response(ttl=RESPONSE_CACHE_TTL):
+    """Cache a read endpoint's 200 responses in memory for ttl seconds.
+
+    Responses carry an ETag built from the data version and the body, and a
+    matching If-None-Match gets a 304. While a fresh entry exists the view is
+    not run at all, so polling does not touch AWS or MySQL.
+
+    Entries are keyed by path and ignore the query string, so cache-busting
+    parameters still hit; only decorate views that do not read request.args.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.endpoint, request.path)
+            now = time.monotonic()
+            with _lock:
+                entry = _cache.get(key)
+                version = _data_version
+            if entry and entry[0] > now and entry[1] == version:
+                response = _cached_response(entry, ttl)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+            body = response.get_data()
+            etag = f"{version}-{hashlib.sha1(body).hexdigest()[:16]}"
+            entry = (now + ttl, version, etag, body, response.mimetype)
+            with _lock:
+                # Skip storing if an ingestion job invalidated the cache while the view ran
+                if _data_version == version:
+                    for stale_key in [k for k, cached in _cache.items() if cached[0] <= now]:
+                        del _cache[stale_key]
+                    _cache[key] = entry
+            response = _cached_response(entry, ttl)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidates_cache(view):
+    """Invalidate cached read responses whenever an ingestion endpoint runs.
+
+    This also happens on errors, since a job that fails part way may already have committed some data.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        finally:
+            invalidate()
+    return wrapper
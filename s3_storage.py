@@ -0,0 +1,179 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+
+from pricing import s3_storage_price
+
+# GetMetricData accepts at most this many queries per request
+MAX_QUERIES_PER_REQUEST = 500
+
+# Parallel GetBucketLocation calls and parallel per-region metric fetches
+MAX_WORKERS = 16
+
+# S3 storage metrics are published once a day, a day or two late; look back far enough to find the latest
+LOOKBACK_DAYS = 3
+
+BYTES_PER_GB = 1024 ** 3
+
+# Overhead, staging and Intelligent-Tiering archive storage types have no offer-file price of their own;
+# S3 bills them at these classes' rates
+BILLED_AS = {
+    'IntelligentTieringAAStorage': 'GlacierStorage',
+    'IntelligentTieringDAAStorage': 'DeepArchiveStorage',
+    'GlacierObjectOverhead': 'GlacierStorage',
+    'GlacierS3ObjectOverhead': 'StandardStorage',
+    'GlacierStagingStorage': 'StandardStorage',
+    'DeepArchiveObjectOverhead': 'DeepArchiveStorage',
+    'DeepArchiveS3ObjectOverhead': 'StandardStorage',
+    'DeepArchiveStagingStorage': 'StandardStorage',
+    'StandardIASizeOverhead': 'StandardIAStorage',
+    'OneZoneIASizeOverhead': 'OneZoneIAStorage',
+    'GlacierInstantRetrievalSizeOverhead': 'GlacierInstantRetrievalStorage',
+}
+
+
+def bucket_region(s3_client, bucket_name):
+    """Region a bucket lives in, or None if it cannot be read (e.g. AccessDenied on another account's bucket).
+
+    GetBucketLocation reports us-east-1 as None and eu-west-1 as 'EU'.
+    """
+    try:
+        location = s3_client.get_bucket_location(Bucket=bucket_name).get('LocationConstraint')
+    except ClientError as e:
+        print(f"Could not get the region of S3 bucket {bucket_name}: {e}")
+        return None
+    if not location:
+        return 'us-east-1'
+    return 'eu-west-1' if location == 'EU' else location
+
+
+def bucket_regions(s3_client, bucket_names):
+    """Look up every bucket's region concurrently and return {bucket name: region}."""
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        regions = executor.map(lambda name: bucket_region(s3_client, name), bucket_names)
+        return dict(zip(bucket_names, regions))
+
+
+def _storage_queries(cloudwatch_client, bucket_names):
+    """Build one GetMetricData query per (bucket, storage type) that actually has data.
+
+    ListMetrics returns only the dimension combinations that exist, so buckets
+    are not queried for storage classes they do not use.
+    """
+    wanted = set(bucket_names)
+    queries = []
+    paginator = cloudwatch_client.get_paginator('list_metrics')
+    for metric_name in ('BucketSizeBytes', 'NumberOfObjects'):
+        for page in paginator.paginate(Namespace='AWS/S3', MetricName=metric_name):
+            for metric in page['Metrics']:
+                dimensions = {d['Name']: d['Value'] for d in metric['Dimensions']}
+                if dimensions.get('BucketName') not in wanted:
+                    continue
+                queries.append({
+                    'Id': f"m{len(queries)}",
+                    'MetricStat': {
+                        'Metric': {
+                            'Namespace': 'AWS/S3',
+                            'MetricName': metric_name,
+                            'Dimensions': metric['Dimensions'],
+                        },
+                        'Period': 86400,
+                        'Stat': 'Average',
+                    },
+                    'ReturnData': True,
+                    'Label': f"{metric_name}|{dimensions['BucketName']}|{dimensions.get('StorageType', '')}",
+                })
+    return queries
+
+
+def fetch_region_storage(cloudwatch_client, bucket_names):
+    """Latest daily size per storage class and object count for buckets in one region.
+
+    Returns {bucket name: {'storage': {storage type: bytes}, 'objects': count}}.
+    NumberOfObjects is only published for AllStorageTypes, so object counts are per bucket.
+    """
+    end_time = datetime.now(timezone.utc)
+    start_time = end_time - timedelta(days=LOOKBACK_DAYS)
+    queries = _storage_queries(cloudwatch_client, bucket_names)
+    labels = {query['Id']: query['Label'] for query in queries}
+    usage = {name: {'storage': {}, 'objects': 0} for name in bucket_names}
+
+    for start in range(0, len(queries), MAX_QUERIES_PER_REQUEST):
+        request_args = {
+            'MetricDataQueries': queries[start:start + MAX_QUERIES_PER_REQUEST],
+            'StartTime': start_time,
+            'EndTime': end_time,
+            'ScanBy': 'TimestampDescending',
+        }
+        while True:
+            response = cloudwatch_client.get_metric_data(**request_args)
+            for result in response['MetricDataResults']:
+                if not result['Values']:
+                    continue
+                metric_name, bucket_name, storage_type = labels[result['Id']].split('|')
+                bucket = usage[bucket_name]
+                # Values are newest first; a later page never replaces a newer value
+                if metric_name == 'NumberOfObjects':
+                    bucket['objects'] = bucket['objects'] or int(result['Values'][0])
+                else:
+                    bucket['storage'].setdefault(storage_type, result['Values'][0])
+
+            if not response.get('NextToken'):
+                break
+            request_args['NextToken'] = response['NextToken']
+    return usage
+
+
+def fetch_storage_metrics(s3_client, bucket_names):
+    """Per-bucket storage analytics for every bucket, querying each region concurrently.
+
+    Returns {bucket name: {'region', 'storage': [{storage_type, size_bytes,
+    size_gb, cost}], 'objects', 'total_usage' (GB), 'total_cost' (USD/month)}}.
+    Buckets whose region is unknown get a None region and no storage figures.
+    """
+    regions = bucket_regions(s3_client, bucket_names)
+    buckets_by_region = {}
+    for name, region in regions.items():
+        if region:
+            buckets_by_region.setdefault(region, []).append(name)
+
+    # boto3 clients are created up front; creating them inside worker threads is not thread safe
+    clients = {region: boto3.client('cloudwatch', region_name=region) for region in buckets_by_region}
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(clients) or 1)) as executor:
+        futures = {
+            region: executor.submit(fetch_region_storage, clients[region], names)
+            for region, names in buckets_by_region.items()
+        }
+        region_usage = {region: future.result() for region, future in futures.items()}
+
+    analytics = {
+        name: {'region': None, 'storage': [], 'objects': 0, 'total_usage': 0.0, 'total_cost': 0.0}
+        for name, region in regions.items() if not region
+    }
+    unpriced = set()
+    for region, usage in region_usage.items():
+        for name, bucket in usage.items():
+            storage = []
+            for storage_type, size_bytes in sorted(bucket['storage'].items()):
+                size_gb = size_bytes / BYTES_PER_GB
+                price = s3_storage_price(region, BILLED_AS.get(storage_type, storage_type))
+                if not price and size_bytes:
+                    unpriced.add((region, storage_type))
+                storage.append({
+                    'storage_type': storage_type,
+                    'size_bytes': int(size_bytes),
+                    'size_gb': round(size_gb, 6),
+                    'cost': round(size_gb * price, 6),
+                })
+            analytics[name] = {
+                'region': region,
+                'storage': storage,
+                'objects': bucket['objects'],
+                'total_usage': round(sum(s['size_gb'] for s in storage), 6),
+                'total_cost': round(sum(s['cost'] for s in storage), 6),
+            }
+    if unpriced:
+        print(f"No S3 storage price for {sorted(unpriced)}; that storage is counted in total_usage at no cost")
+    return analytics
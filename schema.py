@@ -0,0 +1,473 @@
+from datetime import date
+
+# Months of daily cost/usage rows to keep before they are compacted into monthly rows
+DAILY_RETENTION_MONTHS = 3
+
+# Monthly partitions created ahead of the current month
+PARTITIONS_AHEAD = 3
+
+# Table definitions: columns, secondary indexes, unique keys and the DATE column the
+# table is range-partitioned on by month (None for unpartitioned tables). Column
+# names are lower case; MySQL matches them case-insensitively so the older
+# Start_Date / Hours_Used style inserts keep working.
+TABLES = {
+    'cost': {
+        'columns': [
+            ('id', 'BIGINT NOT NULL AUTO_INCREMENT'),
+            ('cost_amount', 'DECIMAL(20, 10)'),
+            ('currency', 'VARCHAR(8)'),
+            ('billing_period', 'VARCHAR(32)'),
+            ('service_type', 'VARCHAR(255)'),
+            ('resource_id', 'VARCHAR(512)'),
+            ('cost_date', 'DATE NOT NULL'),
+            ('usage_type', 'VARCHAR(255)'),
+            ('resource_tags', 'TEXT'),
+            ('region', 'VARCHAR(64)'),
+            ('linked_account', 'VARCHAR(32)'),
+            ('cost_category', 'VARCHAR(255)'),
+            ('invoice_id', 'VARCHAR(64)'),
+            ('tax_amount', 'DECIMAL(20, 10)'),
+            ('discount_amount', 'DECIMAL(20, 10)'),
+            ('total_cost', 'DECIMAL(20, 10)'),
+            # 'ce' for Cost Explorer rows, 'cur' for rows loaded from Cost and Usage Report files
+            ('data_source', "VARCHAR(8) NOT NULL DEFAULT 'ce'"),
+            ('granularity', "ENUM('DAILY', 'MONTHLY') NOT NULL DEFAULT 'DAILY'"),
+        ],
+        'primary_key': ['id', 'cost_date'],
+        'indexes': {
+            'idx_cost_date_service_region': ['cost_date', 'service_type', 'region', 'total_cost'],
+            'idx_cost_service_date': ['service_type', 'cost_date', 'total_cost'],
+            'idx_cost_region_date': ['region', 'cost_date', 'total_cost'],
+            'idx_cost_resource_date': ['resource_id(191)', 'cost_date', 'total_cost'],
+        },
+        'unique': {},
+        'partition_column': 'cost_date',
+    },
+    'usage': {
+        'columns': [
+            ('id', 'BIGINT NOT NULL AUTO_INCREMENT'),
+            ('resource_id', 'VARCHAR(512)'),
+            ('start_date', 'DATE NOT NULL'),
+            ('end_date', 'DATE'),
+            ('unblended_cost', 'DECIMAL(20, 10)'),
+            ('currency', 'VARCHAR(8)'),
+            ('usage_amount', 'DECIMAL(24, 10)'),
+            ('service_type', 'VARCHAR(255)'),
+            ('resource_type', 'VARCHAR(64)'),
+            ('region', 'VARCHAR(64)'),
+            ('linked_account', 'VARCHAR(32)'),
+            ('usage_type', 'VARCHAR(255)'),
+            ('tags', 'TEXT'),
+            ('cost_category', 'VARCHAR(255)'),
+            ('invoice_id', 'VARCHAR(64)'),
+            ('tax_amount', 'DECIMAL(20, 10)'),
+            ('discount_amount', 'DECIMAL(20, 10)'),
+            ('total_cost', 'DECIMAL(20, 10)'),
+            # 'ce' for Cost Explorer rows, 'cur' for rows loaded from Cost and Usage Report files
+            ('data_source', "VARCHAR(8) NOT NULL DEFAULT 'ce'"),
+            ('granularity', "ENUM('DAILY', 'MONTHLY') NOT NULL DEFAULT 'DAILY'"),
+        ],
+        'primary_key': ['id', 'start_date'],
+        'indexes': {
+            'idx_usage_date_service_region': ['start_date', 'service_type', 'region', 'usage_amount', 'total_cost'],
+            'idx_usage_service_date': ['service_type', 'start_date', 'usage_amount', 'total_cost'],
+            'idx_usage_region_date': ['region', 'start_date', 'usage_amount', 'total_cost'],
+            'idx_usage_resource_date': ['resource_id(191)', 'start_date', 'usage_amount', 'total_cost'],
+        },
+        'unique': {},
+        'partition_column': 'start_date',
+    },
+    'ec2_instances': {
+        'columns': [
+            ('id', 'BIGINT NOT NULL AUTO_INCREMENT'),
+            ('instance_id', 'VARCHAR(32) NOT NULL'),
+            ('instance_type', 'VARCHAR(64)'),
+            ('launch_time', 'DATETIME'),
+            ('state', 'VARCHAR(32)'),
+            ('private_ip', 'VARCHAR(64)'),
+            ('public_ip', 'VARCHAR(64)'),
+            ('availability_zone', 'VARCHAR(64)'),
+            ('total_cost', 'DECIMAL(20, 10)'),
+            ('start_date', 'DATE'),
+            ('end_date', 'DATE'),
+            ('hours_used', 'DECIMAL(20, 4)'),
+            ('per_unit_cost_usd', 'DECIMAL(20, 10)'),
+            ('cpu_utilization', 'DECIMAL(10, 4)'),
+            ('memory_utilization_mb', 'DECIMAL(20, 4)'),
+            ('cpu_max', 'DECIMAL(10, 4)'),
+            ('max_memory_util', 'DECIMAL(20, 4)'),
+        ],
+        'primary_key': ['id'],
+        'indexes': {
+            'idx_ec2_type_state': ['instance_type', 'state'],
+        },
+        'unique': {'uq_ec2_instance_id': ['instance_id']},
+        'partition_column': None,
+    },
+    's3_buckets': {
+        'columns': [
+            ('id', 'BIGINT NOT NULL AUTO_INCREMENT'),
+            ('bucket_name', 'VARCHAR(63) NOT NULL'),
+            ('creation_date', 'DATETIME'),
+            ('region', 'VARCHAR(64)'),
+            ('total_usage', 'DECIMAL(24, 4)'),
+            ('total_cost', 'DECIMAL(20, 10)'),
+            ('instance_type', 'VARCHAR(64)'),
+            ('start_date', 'DATE'),
+            ('end_date', 'DATE'),
+            ('hours_used', 'DECIMAL(20, 4)'),
+            ('per_unit_cost_usd', 'DECIMAL(20, 10)'),
+            ('cpu_utilization', 'DECIMAL(10, 4)'),
+            ('memory_utilization_mb', 'DECIMAL(20, 4)'),
+            ('cpu_max', 'DECIMAL(10, 4)'),
+            ('max_memory_util', 'DECIMAL(20, 4)'),
+        ],
+        'primary_key': ['id'],
+        'indexes': {
+            'idx_s3_region': ['region'],
+        },
+        'unique': {'uq_s3_bucket_name': ['bucket_name']},
+        'partition_column': None,
+    },
+    'rds_instances': {
+        'columns': [
+            ('id', 'BIGINT NOT NULL AUTO_INCREMENT'),
+            ('db_instance_id', 'VARCHAR(63) NOT NULL'),
+            ('db_instance_class', 'VARCHAR(64)'),
+            ('db_engine', 'VARCHAR(32)'),
+            ('db_status', 'VARCHAR(32)'),
+            ('db_instance_status', 'VARCHAR(32)'),
+            ('master_username', 'VARCHAR(64)'),
+            ('endpoint_address', 'VARCHAR(255)'),
+            ('endpoint_port', 'INT'),
+            ('vpc_id', 'VARCHAR(32)'),
+            ('availability_zone', 'VARCHAR(64)'),
+            ('multi_az', 'BOOLEAN'),
+            ('backup_retention_period', 'INT'),
+            ('tags', 'TEXT'),
+            ('storage_encrypted', 'BOOLEAN'),
+            ('instance_create_time', 'DATETIME'),
+            ('license_model', 'VARCHAR(64)'),
+            ('cost', 'DECIMAL(20, 10)'),
+            ('usage_quantity', 'DECIMAL(24, 10)'),
+            ('total_cost', 'DECIMAL(20, 10)'),
+            ('instance_type', 'VARCHAR(64)'),
+            ('start_date', 'DATE'),
+            ('end_date', 'DATE'),
+            ('hours_used', 'DECIMAL(20, 4)'),
+            ('per_unit_cost_usd', 'DECIMAL(20, 10)'),
+            ('cpu_utilization', 'DECIMAL(10, 4)'),
+            ('memory_utilization_mb', 'DECIMAL(20, 4)'),
+            ('cpu_max', 'DECIMAL(10, 4)'),
+            ('max_memory_util', 'DECIMAL(20, 4)'),
+        ],
+        'primary_key': ['id'],
+        'indexes': {
+            'idx_rds_class_engine': ['db_instance_class', 'db_engine'],
+        },
+        'unique': {'uq_rds_instance_id': ['db_instance_id']},
+        'partition_column': None,
+    },
+    'instance_usage': {
+        'columns': [
+            ('id', 'BIGINT NOT NULL AUTO_INCREMENT'),
+            ('instance_type', 'VARCHAR(64)'),
+            ('start_date', 'DATE'),
+            ('end_date', 'DATE'),
+            ('region', 'VARCHAR(64)'),
+            ('hours_used', 'DECIMAL(20, 4)'),
+            ('per_unit_cost_usd', 'DECIMAL(20, 10)'),
+            ('total_cost_usd', 'DECIMAL(20, 10)'),
+            ('cpu_utilization_percent', 'DECIMAL(10, 4)'),
+            ('memory_utilization_mb', 'DECIMAL(20, 4)'),
+            ('cpu_max', 'DECIMAL(10, 4)'),
+            ('max_memory_util', 'DECIMAL(20, 4)'),
+        ],
+        'primary_key': ['id'],
+        'indexes': {
+            'idx_instance_usage_date_region': ['start_date', 'region', 'instance_type'],
+        },
+        'unique': {},
+        'partition_column': None,
+    },
+    'inventory_state': {
+        'columns': [
+            ('resource_type', 'VARCHAR(32) NOT NULL'),
+            ('resource_id', 'VARCHAR(255) NOT NULL'),
+            ('content_hash', 'CHAR(64) NOT NULL'),
+            ('first_seen', 'DATETIME NOT NULL'),
+            ('last_changed', 'DATETIME NOT NULL'),
+            ('terminated_at', 'DATETIME NULL'),
+            ('metrics_hash', 'CHAR(64) NULL'),
+        ],
+        'primary_key': ['resource_type', 'resource_id'],
+        'indexes': {},
+        'unique': {},
+        'partition_column': None,
+    },
+    'inventory_changes': {
+        'columns': [
+            ('id', 'BIGINT NOT NULL AUTO_INCREMENT'),
+            ('resource_type', 'VARCHAR(32) NOT NULL'),
+            ('resource_id', 'VARCHAR(255) NOT NULL'),
+            ('change_type', "ENUM('insert', 'update', 'terminate') NOT NULL"),
+            ('content_hash', 'CHAR(64) NULL'),
+            ('attributes', 'JSON NULL'),
+            ('changed_at', 'DATETIME NOT NULL'),
+        ],
+        'primary_key': ['id'],
+        'indexes': {
+            'idx_inventory_changes_resource': ['resource_type', 'resource_id', 'changed_at'],
+        },
+        'unique': {},
+        'partition_column': None,
+    },
+}
+
+# Columns that identify a row when daily cost/usage rows are compacted into a monthly row
+COMPACTION_KEYS = {
+    'cost': ['data_source', 'currency', 'service_type', 'resource_id', 'usage_type', 'region', 'linked_account'],
+    'usage': ['data_source', 'resource_id', 'currency', 'service_type', 'resource_type', 'region', 'linked_account',
+              'usage_type'],
+}
+COMPACTION_SUMS = {
+    'cost': ['cost_amount', 'tax_amount', 'discount_amount', 'total_cost'],
+    'usage': ['unblended_cost', 'usage_amount', 'tax_amount', 'discount_amount', 'total_cost'],
+}
+
+
+def _add_months(day, months):
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_name(month_start):
+    return f"p{month_start:%Y%m}"
+
+
+def _partition_clause(month_start):
+    return (f"PARTITION {_partition_name(month_start)} "
+            f"VALUES LESS THAN ('{_add_months(month_start, 1):%Y-%m-%d}')")
+
+
+def _monthly_partitions(first_month, last_month):
+    """Partition definitions for every month from first_month to last_month, plus a catch-all."""
+    clauses = []
+    month = first_month
+    while month <= last_month:
+        clauses.append(_partition_clause(month))
+        month = _add_months(month, 1)
+    clauses.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    return ',\n'.join(clauses)
+
+
+def create_table_sql(name, today=None):
+    """Return the CREATE TABLE IF NOT EXISTS statement for one table in TABLES."""
+    table = TABLES[name]
+    lines = [f"`{column}` {definition}" for column, definition in table['columns']]
+    lines.append(f"PRIMARY KEY ({', '.join(table['primary_key'])})")
+    for index, columns in table['unique'].items():
+        lines.append(f"UNIQUE KEY {index} ({', '.join(columns)})")
+    for index, columns in table['indexes'].items():
+        lines.append(f"KEY {index} ({', '.join(columns)})")
+    sql = f"CREATE TABLE IF NOT EXISTS `{name}` (\n    " + ',\n    '.join(lines) + "\n)"
+
+    if table['partition_column']:
+        this_month = (today or date.today()).replace(day=1)
+        sql += (f"\nPARTITION BY RANGE COLUMNS({table['partition_column']}) (\n"
+                + _monthly_partitions(_add_months(this_month, -DAILY_RETENTION_MONTHS - 12),
+                                      _add_months(this_month, PARTITIONS_AHEAD))
+                + "\n)")
+    return sql
+
+
+def _existing_columns(cursor, name):
+    cursor.execute(
+        "SELECT LOWER(COLUMN_NAME) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (name,)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _existing_indexes(cursor, name):
+    cursor.execute(
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (name,)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _existing_partitions(cursor, name):
+    cursor.execute(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION",
+        (name,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def migrate_table(cursor, name, today=None):
+    """Bring a hand-made table up to its TABLES definition without losing data."""
+    table = TABLES[name]
+    columns = _existing_columns(cursor, name)
+    for column, definition in table['columns']:
+        if column not in columns:
+            print(f"Adding column {name}.{column}")
+            cursor.execute(f"ALTER TABLE `{name}` ADD COLUMN `{column}` {definition}")
+
+    indexes = _existing_indexes(cursor, name)
+    for index, unique_columns in table['unique'].items():
+        if index not in indexes:
+            # Earlier versions appended a full copy of the inventory on every run; keep the newest row per resource
+            key = unique_columns[0]
+            print(f"Removing duplicate {name} rows before adding {index}")
+            cursor.execute(
+                f"DELETE older FROM `{name}` older JOIN `{name}` newer "
+                f"ON older.{key} = newer.{key} AND older.id < newer.id"
+            )
+            cursor.execute(f"ALTER TABLE `{name}` ADD UNIQUE KEY {index} ({', '.join(unique_columns)})")
+    for index, index_columns in table['indexes'].items():
+        if index not in indexes:
+            print(f"Adding index {name}.{index}")
+            cursor.execute(f"ALTER TABLE `{name}` ADD KEY {index} ({', '.join(index_columns)})")
+
+    partition_column = table['partition_column']
+    if partition_column and not _existing_partitions(cursor, name):
+        # Every unique key of a partitioned table must include the partition column
+        print(f"Partitioning {name} by month on {partition_column}")
+        definitions = dict(table['columns'])
+        cursor.execute(f"ALTER TABLE `{name}` MODIFY `{partition_column}` {definitions[partition_column]}")
+        cursor.execute(f"ALTER TABLE `{name}` DROP PRIMARY KEY, ADD PRIMARY KEY ({', '.join(table['primary_key'])})")
+        this_month = (today or date.today()).replace(day=1)
+        cursor.execute(
+            f"SELECT MIN({partition_column}) FROM `{name}`"
+        )
+        oldest = cursor.fetchone()[0]
+        first_month = oldest.replace(day=1) if oldest else _add_months(this_month, -DAILY_RETENTION_MONTHS - 12)
+        cursor.execute(
+            f"ALTER TABLE `{name}` PARTITION BY RANGE COLUMNS({partition_column}) (\n"
+            + _monthly_partitions(first_month, _add_months(this_month, PARTITIONS_AHEAD)) + "\n)"
+        )
+
+
+def ensure_future_partitions(cursor, name, today=None):
+    """Split pmax so monthly partitions exist PARTITIONS_AHEAD months past today.
+
+    Rows that already landed in pmax move into their month. Returns the number of partitions added.
+    """
+    partitions = _existing_partitions(cursor, name)
+    if not partitions:
+        return 0
+    last_month = _add_months((today or date.today()).replace(day=1), PARTITIONS_AHEAD)
+    monthly = sorted(p for p in partitions if p != 'pmax')
+    month = _add_months(date(int(monthly[-1][1:5]), int(monthly[-1][5:7]), 1), 1)
+    new_partitions = []
+    while month <= last_month:
+        new_partitions.append(_partition_clause(month))
+        month = _add_months(month, 1)
+    if new_partitions:
+        print(f"Adding {len(new_partitions)} partitions to {name}")
+        cursor.execute(
+            f"ALTER TABLE `{name}` REORGANIZE PARTITION pmax INTO (\n"
+            + ',\n'.join(new_partitions) + ",\nPARTITION pmax VALUES LESS THAN (MAXVALUE)\n)"
+        )
+    return len(new_partitions)
+
+
+def maintain_partitions(db, today=None):
+    """Keep monthly partitions PARTITIONS_AHEAD months ahead on every partitioned table.
+
+    Run this from a recurring job; otherwise new rows pile up in pmax once
+    today passes the last monthly partition. Returns {table: partitions added}.
+    """
+    cursor = db.cursor()
+    try:
+        added = {name: ensure_future_partitions(cursor, name, today)
+                 for name, table in TABLES.items() if table['partition_column']}
+        db.commit()
+        return added
+    finally:
+        cursor.close()
+
+
+def ensure_inventory_tables(cursor):
+    """Create the snapshot state and change-history tables, or add columns newer versions need."""
+    for name in ('inventory_state', 'inventory_changes'):
+        cursor.execute(create_table_sql(name))
+        migrate_table(cursor, name)
+
+
+def init_schema(db, today=None):
+    """Create every table that is missing and migrate the ones that already exist."""
+    cursor = db.cursor()
+    try:
+        for name, table in TABLES.items():
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                (name,)
+            )
+            if cursor.fetchone()[0]:
+                migrate_table(cursor, name, today)
+            else:
+                print(f"Creating table {name}")
+                cursor.execute(create_table_sql(name, today))
+            if table['partition_column']:
+                ensure_future_partitions(cursor, name, today)
+        db.commit()
+    finally:
+        cursor.close()
+
+
+def compact_table(db, name, today=None):
+    """Replace daily rows older than DAILY_RETENTION_MONTHS with one monthly row per key.
+
+    Works one month partition at a time, so each statement only touches that
+    partition. The monthly row is dated the first of its month and lands in the
+    same partition. Returns the compacted partition names.
+    """
+    table = TABLES[name]
+    date_column = table['partition_column']
+    keys = COMPACTION_KEYS[name]
+    sums = COMPACTION_SUMS[name]
+    cutoff = _add_months((today or date.today()).replace(day=1), -DAILY_RETENTION_MONTHS)
+    compacted = []
+
+    cursor = db.cursor()
+    try:
+        for partition in _existing_partitions(cursor, name):
+            if partition == 'pmax':
+                continue
+            month_start = date(int(partition[1:5]), int(partition[5:7]), 1)
+            if month_start >= cutoff:
+                continue
+            cursor.execute(
+                f"SELECT COUNT(*) FROM `{name}` PARTITION ({partition}) WHERE granularity = 'DAILY'"
+            )
+            if not cursor.fetchone()[0]:
+                continue
+
+            extra_columns = ['end_date'] if name == 'usage' else ['billing_period']
+            extra_values = (["LAST_DAY(%s)"] if name == 'usage' else ["DATE_FORMAT(%s, '%%Y-%%m')"])
+            insert_columns = [date_column] + extra_columns + keys + sums + ['granularity']
+            select_values = (["%s"] + extra_values + keys
+                             + [f"SUM({column})" for column in sums] + ["'MONTHLY'"])
+            cursor.execute(
+                f"INSERT INTO `{name}` ({', '.join(insert_columns)}) "
+                f"SELECT {', '.join(select_values)} FROM `{name}` PARTITION ({partition}) "
+                f"WHERE granularity = 'DAILY' GROUP BY {', '.join(keys)}",
+                (month_start, month_start)
+            )
+            cursor.execute(f"DELETE FROM `{name}` PARTITION ({partition}) WHERE granularity = 'DAILY'")
+            db.commit()
+            compacted.append(partition)
+            print(f"Compacted {name} partition {partition} into monthly rows")
+        return compacted
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
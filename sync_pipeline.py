@@ -0,0 +1,125 @@
+import queue
+import threading
+import time
+
+# Batches a collector may have fetched but not yet written before it blocks
+QUEUE_SIZE = 4
+
+# Marks the end of a collector's output on its queue
+_DONE = object()
+
+
+class Stage:
+    """One collector feeding one bulk writer.
+
+    produce() returns an iterable of batches (lists of rows); write(batch) stores
+    one batch and must open its own database connection, since it runs on the
+    stage's writer thread.
+    """
+
+    def __init__(self, name, produce, write, writers=1):
+        self.name = name
+        self.produce = produce
+        self.write = write
+        self.writers = writers
+
+
+def _new_stats():
+    return {
+        'batches': 0,
+        'items': 0,
+        'fetch_seconds': 0.0,
+        'write_seconds': 0.0,
+        'backpressure_seconds': 0.0,
+        'results': [],
+        'error': None,
+    }
+
+
+def _run_producer(stage, batches, stats, lock):
+    started = time.monotonic()
+    try:
+        for batch in stage.produce():
+            waited = time.monotonic()
+            # Blocks while the queue is full, so a slow writer throttles its collector
+            batches.put(batch)
+            with lock:
+                stats['backpressure_seconds'] += time.monotonic() - waited
+    except Exception as e:
+        print(f"Error fetching {stage.name} data: {e}")
+        with lock:
+            stats['error'] = stats['error'] or f"fetch: {e}"
+    finally:
+        with lock:
+            stats['fetch_seconds'] = time.monotonic() - started - stats['backpressure_seconds']
+        for _ in range(stage.writers):
+            batches.put(_DONE)
+
+
+def _run_writer(stage, batches, stats, lock):
+    failed = False
+    while True:
+        batch = batches.get()
+        if batch is _DONE:
+            return
+        if failed or not batch:
+            # Keep draining after a failure so the collector is never left blocked
+            continue
+        started = time.monotonic()
+        try:
+            result = stage.write(batch)
+            with lock:
+                stats['batches'] += 1
+                stats['items'] += len(batch)
+                if result is not None:
+                    stats['results'].append(result)
+        except Exception as e:
+            print(f"Error writing {stage.name} data: {e}")
+            failed = True
+            with lock:
+                stats['error'] = stats['error'] or f"write: {e}"
+        finally:
+            with lock:
+                stats['write_seconds'] += time.monotonic() - started
+
+
+def run_pipeline(stages, queue_size=QUEUE_SIZE):
+    """Run every stage's collector and writers concurrently and return a summary.
+
+    Each stage gets a bounded queue between its collector and its writers, so
+    fetching from AWS and writing to MySQL overlap both within and across
+    stages, and the total time approaches that of the slowest stage.
+    """
+    started = time.monotonic()
+    lock = threading.Lock()
+    stats = {stage.name: _new_stats() for stage in stages}
+    threads = []
+
+    for stage in stages:
+        batches = queue.Queue(maxsize=queue_size)
+        threads.append(threading.Thread(
+            target=_run_producer, args=(stage, batches, stats[stage.name], lock),
+            name=f"sync-{stage.name}-fetch", daemon=True
+        ))
+        for i in range(stage.writers):
+            threads.append(threading.Thread(
+                target=_run_writer, args=(stage, batches, stats[stage.name], lock),
+                name=f"sync-{stage.name}-write-{i}", daemon=True
+            ))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for stage_stats in stats.values():
+        for key in ('fetch_seconds', 'write_seconds', 'backpressure_seconds'):
+            stage_stats[key] = round(stage_stats[key], 3)
+        if not stage_stats['results']:
+            del stage_stats['results']
+
+    return {
+        'total_seconds': round(time.monotonic() - started, 3),
+        'succeeded': all(stage_stats['error'] is None for stage_stats in stats.values()),
+        'stages': stats,
+    }